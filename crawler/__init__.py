@@ -22,5 +22,9 @@ class Crawler(object):
         self.join()
 
     def join(self):
-        for worker in self.workers:
-            worker.join()
+        try:
+            for worker in self.workers:
+                worker.join()
+        finally:
+            # Flush the frontier's pending writes even if interrupted.
+            self.frontier.close()
@@ -1,23 +1,38 @@
 import os
-import shelve
+import heapq
+import sqlite3
 
-from threading import Thread, RLock
-from queue import Queue, Empty
+from threading import Thread, Lock, Event, Condition
 
-from utils import get_logger, get_urlhash, normalize
+from utils import get_logger, get_urlhash, canonicalize
+from utils.urlcache import cached_urlparse
+from utils.bloom import ScalableBloomFilter
 from scraper import is_valid, s
 import time
 
-from collections import defaultdict
+from collections import defaultdict, deque
 class Frontier(object): 
+    # Pending writes are flushed to the save file in one transaction once this
+    # many have accumulated, or every FLUSH_INTERVAL seconds, whichever is first.
+    FLUSH_SIZE = 256
+    FLUSH_INTERVAL = 0.5
+
     def __init__(self, config, restart):
         self.logger = get_logger("FRONTIER")
         self.config = config
-        self.to_be_downloaded = Queue()
-
-        self.lock = RLock()
-
-        self.last_request_time = defaultdict(float) # Track the last request time for each domain 
+        # Urls waiting to be downloaded, one queue per domain.
+        self.to_be_downloaded = defaultdict(deque)
+
+        # Heap of (ready_time, domain) for every domain that has urls waiting
+        # and is not being downloaded from right now. A domain is ready once the
+        # politeness delay has passed since its last request completed.
+        self.ready_domains = []
+        # Domains that are either in ready_domains or being downloaded from.
+        self.scheduled_domains = set()
+        self.next_request_time = defaultdict(float)
+
+        self.lock = Lock()
+        self.work_added = Condition(self.lock)
         
         if not os.path.exists(self.config.save_file) and not restart:
             # Save file does not exist, but request to load save.
@@ -29,86 +44,158 @@ class Frontier(object):
             self.logger.info(
                 f"Found save file {self.config.save_file}, deleting it.")
             os.remove(self.config.save_file)
+            # Drop the write-ahead log left behind by the old save file too.
+            for suffix in ("-wal", "-shm"):
+                if os.path.exists(self.config.save_file + suffix):
+                    os.remove(self.config.save_file + suffix)
         # Load existing save file, or create one if it does not exist.
-        self.save = shelve.open(self.config.save_file)
+        # WAL journaling lets one fsync cover a whole batch of writes.
+        self.save = sqlite3.connect(
+            self.config.save_file, isolation_level=None, check_same_thread=False)
+        self.save.execute("PRAGMA journal_mode=WAL")
+        self.save.execute("PRAGMA synchronous=NORMAL")
+        # Hashes are stored as raw 32 byte digests, and WITHOUT ROWID keeps each
+        # row in the primary key's b-tree instead of a separate table and index.
+        self.save.execute(
+            "CREATE TABLE IF NOT EXISTS urls "
+            "(hash BLOB PRIMARY KEY, url TEXT, done INT) WITHOUT ROWID")
+
+        # Hashes of every url discovered, mirrors the save file. A false positive
+        # only means a new url is dropped, the same as if it had been seen.
+        self.seen_bloom = ScalableBloomFilter(initial_capacity=1000000, error_rate=0.001)
+        self.pending_writes = deque() # (hash, url, done) rows not yet written to the save file.
+        self.flush_requested = Event()
+        self.closed = Event()
+        self.flusher = Thread(target=self._flush_loop, daemon=True)
+        self.flusher.start()
+
         if restart:
             for url in self.config.seed_urls:
                 self.add_url(url)
         else:
             # Set the frontier state with contents of save file.
             self._parse_save_file()
-            if not self.save:
+            if not self.seen_bloom:
                 for url in self.config.seed_urls:
                     self.add_url(url)
 
     def _parse_save_file(self):
         ''' This function can be overridden for alternate saving techniques. '''
         with self.lock:
-            total_count = len(self.save)
             tbd_count = 0 
 
-            for url, completed in self.save.values():
+            for urlhash, url, completed in self.save.execute(
+                    "SELECT hash, url, done FROM urls"):
+                self.seen_bloom.add(urlhash.hex())
                 if not completed and is_valid(url):
-                    self.to_be_downloaded.put(url)
+                    self._enqueue(url)
                     tbd_count += 1
             self.logger.info(
-                f"Found {tbd_count} urls to be downloaded from {total_count} "
+                f"Found {tbd_count} urls to be downloaded from {len(self.seen_bloom)} "
                 f"total urls discovered.")
-            
+
+    def _flush_loop(self):
+        # Runs on a background thread so workers never wait on disk syncs.
+        while not self.closed.is_set():
+            self.flush_requested.wait(self.FLUSH_INTERVAL)
+            self.flush_requested.clear()
+            self._flush()
+        # Write whatever was queued while closing.
+        self._flush()
+
+    def close(self):
+        # Stop the flusher right away, after it has written every pending url.
+        self.closed.set()
+        self.flush_requested.set()
+        self.flusher.join()
+        self.save.close()
+
+    def _flush(self):
+        # Swap the pending rows out under the lock, but write them without it
+        # so workers are never blocked on disk.
+        with self.lock:
+            if not self.pending_writes:
+                return
+            rows = list(self.pending_writes)
+            self.pending_writes.clear()
+
+        self.save.execute("BEGIN")
+        self.save.executemany(
+            "INSERT OR REPLACE INTO urls (hash, url, done) VALUES (?, ?, ?)", rows)
+        self.save.execute("COMMIT")
+
+    def _queue_write(self, urlhash, url, completed):
+        # Must be called with self.lock held.
+        self.pending_writes.append((bytes.fromhex(urlhash), url, int(completed)))
+        if len(self.pending_writes) >= self.FLUSH_SIZE:
+            self.flush_requested.set()
+
+
+    def _enqueue(self, url):
+        # Must be called with self.lock held.
+        domain = self._get_domain(url)
+        self.to_be_downloaded[domain].append(url)
+        if domain not in self.scheduled_domains:
+            self.scheduled_domains.add(domain)
+            heapq.heappush(self.ready_domains, (self.next_request_time[domain], domain))
+            self.work_added.notify()
 
     def get_tbd_url(self):
-        try:
-            return self.to_be_downloaded.get(timeout=3)
-        except Empty:
-            return None
+        # Hands out a url from whichever domain is ready first, so a worker
+        # only ever waits when every domain with work is still cooling down.
+        # Waiting releases the lock. While other workers are still downloading,
+        # their pages can add or requeue work, so only give up once no domain
+        # is scheduled at all.
+        with self.work_added:
+            while True:
+                if self.ready_domains:
+                    current_time = time.monotonic()
+                    ready_time, domain = self.ready_domains[0]
+                    if ready_time <= current_time:
+                        heapq.heappop(self.ready_domains)
+                        return self.to_be_downloaded[domain].popleft()
+                    self.work_added.wait(ready_time - current_time)
+                elif self.scheduled_domains:
+                    # Woken by mark_url_complete, or by _enqueue for new domains.
+                    self.work_added.wait()
+                else:
+                    return None
 
     def add_url(self, url):
-        url = normalize(url)
+        url = canonicalize(url)
         urlhash = get_urlhash(url)
         with self.lock:
-            if urlhash not in self.save:
-                self.save[urlhash] = (url, False)
-                self.save.sync()
-                self.to_be_downloaded.put(url)
+            if self.seen_bloom.add(urlhash):
+                self._queue_write(urlhash, url, False)
+                self._enqueue(url)
     
     def mark_url_complete(self, url):
         urlhash = get_urlhash(url)
 
-        if urlhash not in self.save:
-            # This should not happen.
-            self.logger.error(
-                f"Completed url {url}, but have not seen it before.")
-
-        self.save[urlhash] = (url, True)
-        self.save.sync()
-
-        domain = self._get_domain(url)
-        if not domain:
-            return
-
         with self.lock:
-            self.last_request_time[domain] = time.time()
+            if urlhash not in self.seen_bloom:
+                # This should not happen.
+                self.logger.error(
+                    f"Completed url {url}, but have not seen it before.")
+
+            self._queue_write(urlhash, url, True)
+
+            # The domain may be requested again once the politeness delay has passed.
+            domain = self._get_domain(url)
+            self.next_request_time[domain] = time.monotonic() + self.config.time_delay
+            if self.to_be_downloaded[domain]:
+                heapq.heappush(self.ready_domains, (self.next_request_time[domain], domain))
+                self.work_added.notify()
+            else:
+                self.scheduled_domains.discard(domain)
+                if not self.scheduled_domains:
+                    # Nothing is queued or being downloaded, so no more work can
+                    # come in. Wake every waiting worker so they can stop.
+                    self.work_added.notify_all()
 
-
-    def wait_for_request(self, url):
-        domain = self._get_domain(url)
-        current_time = time.time()
-
-        if not domain:
-            return
-
-        with self.lock:
-            elapsed_time = current_time - self.last_request_time[domain]
-            # print(f"Requesting domain: {domain} at {elapsed_time}")
-            if elapsed_time < 0.5:  # 500 ms
-                time.sleep(0.5 - elapsed_time)  # Wait for the remaining time
-            
-            self.last_request_time[domain] = time.time()
-            
     def _get_domain(self, url):
-        from urllib.parse import urlparse
-        subdomain = urlparse(url).hostname
-        return subdomain
+        subdomain = cached_urlparse(url).hostname
+        return subdomain or ""
 
     # Get number of unique URLs found after discarding the fragment part
     def log_num_unique_urls(self):
@@ -116,7 +203,8 @@ class Frontier(object):
 
     # Get the longest page (page with the highest word count)
     def log_longest_page(self):
-        self.logger.info(f"Length of the longest page ({s.max_page_url}): {s.max_page_len} words")
+        max_page_len, max_page_url = s.get_longest_page()
+        self.logger.info(f"Length of the longest page ({max_page_url}): {max_page_len} words")
 
     # Get the 50 most common words from all crawled domains
     def log_top_words(self):
@@ -126,8 +214,9 @@ class Frontier(object):
 
     # Alphabetical list of subdomains in the uci.edu domain, with number of unique pages
     def log_subdomain_counts(self):
-        self.logger.info(f"Number of subdomains: {len(s.subdomain_counts)}")
-        sorted_subdomains = sorted(s.subdomain_counts.items())
+        subdomain_counts = s.get_subdomain_counts()
+        self.logger.info(f"Number of subdomains: {len(subdomain_counts)}")
+        sorted_subdomains = sorted(subdomain_counts.items())
         self.logger.info("List of subdomains and the number of unique pages found in them:")
         for subdomain, count in sorted_subdomains:
             self.logger.info(f"{subdomain}, {count}")
@@ -4,7 +4,9 @@ from inspect import getsource
 from utils.download import download
 from utils import get_logger
 import scraper
-import time
+
+# Source of scraper.py, read once for the import checks below.
+_SCRAPER_SRC = getsource(scraper)
 
 class Worker(Thread): 
     def __init__(self, worker_id, config, frontier):
@@ -12,8 +14,8 @@ class Worker(Thread):
         self.config = config
         self.frontier = frontier
         # basic check for requests in scraper
-        assert {getsource(scraper).find(req) for req in {"from requests import", "import requests"}} == {-1}, "Do not use requests in scraper.py"
-        assert {getsource(scraper).find(req) for req in {"from urllib.request import", "import urllib.request"}} == {-1}, "Do not use urllib.request in scraper.py"
+        assert not any(req in _SCRAPER_SRC for req in ("from requests import", "import requests")), "Do not use requests in scraper.py"
+        assert not any(req in _SCRAPER_SRC for req in ("from urllib.request import", "import urllib.request")), "Do not use urllib.request in scraper.py"
         super().__init__(daemon=True)
     
     def run(self):
@@ -21,41 +23,45 @@ class Worker(Thread):
         while True:
             i += 1
             if i % 100 == 0:
-                with self.frontier.lock:
-                    self.frontier.log_num_unique_urls()
-                    self.frontier.log_longest_page()
-                    self.frontier.log_top_words()
-                    self.frontier.log_subdomain_counts()
+                # The statistics are merged from per-thread snapshots and never touch
+                # frontier state, so the frontier lock is not held while logging them.
+                self.frontier.log_num_unique_urls()
+                self.frontier.log_longest_page()
+                self.frontier.log_top_words()
+                self.frontier.log_subdomain_counts()
 
             tbd_url = self.frontier.get_tbd_url()
             if not tbd_url:
                 self.logger.info("Frontier is empty. Stopping Crawler.")
                 break
 
-            # wait 500ms for each respective subdomain before downloading
-            self.frontier.wait_for_request(tbd_url)
-
-            resp = download(tbd_url, self.config, self.logger)
-
-            self.logger.info(
-                f"Downloaded {tbd_url}, status <{resp.status}>, "
-                f"using cache {self.config.cache_server}.")
+            # The frontier only hands out urls whose domain has waited out the
+            # politeness delay, so download right away.
+            try:
+                resp = download(tbd_url, self.config, self.logger)
 
+                self.logger.info(
+                    f"Downloaded {tbd_url}, status <{resp.status}>, "
+                    f"using cache {self.config.cache_server}.")
 
-            with self.frontier.lock:
-                scraped_urls = scraper.scraper(tbd_url, resp)
 
-            for scraped_url in scraped_urls:
-                self.frontier.add_url(scraped_url)
-            self.frontier.mark_url_complete(tbd_url)
+                try:
+                    scraped_urls = scraper.scraper(tbd_url, resp)
+                except Exception:
+                    # One bad page must not stop this worker, log it and move on.
+                    self.logger.exception(f"Failed to scrape {tbd_url}.")
+                    scraped_urls = []
 
-            # 100ms delay after every request to avoid overloading the server
-            time.sleep(0.1)
+                for scraped_url in scraped_urls:
+                    self.frontier.add_url(scraped_url)
+            finally:
+                # Always give the url's domain back to the frontier, even if this
+                # page raised, so its other urls are not stuck for every worker.
+                self.frontier.mark_url_complete(tbd_url)
 
-        with self.frontier.lock:
-            self.frontier.log_num_unique_urls()
-            self.frontier.log_longest_page()
-            self.frontier.log_top_words()
-            self.frontier.log_subdomain_counts()
+        self.frontier.log_num_unique_urls()
+        self.frontier.log_longest_page()
+        self.frontier.log_top_words()
+        self.frontier.log_subdomain_counts()
         # Logging statistics after crawling for report questions
 
@@ -1,17 +1,97 @@
 import re
+import math
+from hashlib import blake2b
 import numpy as np
-from bs4 import BeautifulSoup
-from collections import defaultdict
-from urllib.parse import urlparse, urljoin, parse_qs, urlencode, urlunparse
+import lxml.html
+from lxml import etree
+from collections import defaultdict, Counter
+from threading import Lock, local
+from functools import lru_cache
+from urllib.parse import urljoin, urlsplit, urlunsplit, unquote_plus
+from utils import canonicalize
+from utils.urlcache import cached_urlparse
+from utils.sketch import CountMinSketch
+from utils.bloom import ScalableBloomFilter
+
+
+# File extensions of pages that are not HTML/webpages.
+_BAD_EXT = frozenset( [ "css", "js", "bmp", "gif", "jpeg", "jpg", "ico",
+    "png", "tiff", "tif", "mid", "mp2", "mp3", "mp4",
+    "wav", "avi", "mov", "mpeg", "ram", "m4v", "mkv", "ogg", "ogv", "pdf",
+    "ps", "eps", "tex", "ppt", "pptx", "doc", "docx", "xls", "xlsx", "names",
+    "data", "dat", "exe", "bz2", "tar", "msi", "bin", "7z", "psd", "dmg", "iso",
+    "epub", "dll", "cnf", "tgz", "sha1",
+    "thmx", "mso", "arff", "rtf", "jar", "csv",
+    "rm", "smil", "wmv", "swf", "wma", "zip", "rar", "gz",
+    "ppsx", "pps", "txt", "bib", "sql", "xml", "pov", "tsv", "mat", "in", "out", "scm", "db",
+    "1_manual", "2_manual", "mpg", "img", "svg", "webp", "heic", "lif", "hqx", "fig",
+    "lsp", "java", "war", "c", "h", "cpp", "hpp", "cp", "sh", "ss", "pl", "rss", "ff",
+    "rle", "z", "shar", "ova", "edelsbrunner", "class", "prn",
+    "conf", "cls", "can", "odp", "results", "sas", "odc", "ma", "pd", "mol", "grm", "nb" ] )
+
+# Number of set bits in every element of a uint64 array. np.bitwise_count needs NumPy 2.0,
+# older versions count them with the SWAR (SIMD within a register) method.
+if hasattr(np, 'bitwise_count'):
+    _popcount64 = np.bitwise_count
+else:
+    def _popcount64(x):
+        x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+        x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+        x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+        return (x * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+# URL schemes that can be crawled.
+_SCHEMES = frozenset( [ "http", "https" ] )
+
+# Content types of pages that are parsed as HTML.
+_HTML_TYPES = frozenset( [ "text/html", "application/xhtml+xml" ] )
+
+# Words counted towards a page's length: alphanumeric sequences with no underscores.
+# Most text is plain ASCII, which is split faster by a translation table that lowercases letters
+# and turns every other non-alphanumeric character into a space, with the same result.
+_WORD_RE = re.compile(r'[^\W_]+')
+_ASCII_WORD_TABLE = str.maketrans({ chr(c): chr(c).lower() if chr(c).isalnum() else ' ' for c in range(128) })
+
+# Text nodes of a page's readable text, split into link text and everything else.
+# Script and style contents are not text a reader sees, so they are left out of both.
+_NOT_CODE = 'not(ancestor::script or ancestor::style or ancestor::noscript)'
+_TEXT_XPATH = etree.XPath(f'//text()[not(ancestor::a[@href]) and {_NOT_CODE}]')
+_ANCHOR_TEXT_XPATH = etree.XPath(f'//a[@href]//text()[{_NOT_CODE}]')
+
+# Link targets of every anchor, returned as plain strings rather than lxml's smart strings.
+_HREF_XPATH = etree.XPath('//a/@href', smart_strings=False)
+
+# Hrefs that can never lead to a new crawlable page: fragments of the current page
+# and non-HTTP schemes. They are dropped before any joining or parsing.
+_SKIP_HREF_PREFIXES = ('#', 'mailto:', 'javascript:', 'tel:')
+
+
+class ScraperStats:
+    # Report statistics recorded by one worker thread. Each thread updates its
+    # own copy without locking, and Scraper merges them whenever they are reported.
+    __slots__ = ("subdomain_counts", "token_counts", "longest_page")
+
+    def __init__(self):
+        self.subdomain_counts = defaultdict(int) # Number of subdomains found, and number of unique pages in them.
+        self.token_counts = Counter() # The top 50 most common words.
+        self.longest_page = (0, "") # Word count and URL of the longest page.
 
 
 class Scraper:
+    # Instance attributes are fixed, see __init__. Slots make the attribute lookups
+    # on every page and link plain offset loads instead of dictionary lookups.
+    __slots__ = ("lock", "visited_urls", "_local", "_all_stats", "site_counts", "_allowed_hosts",
+                 "MAX_DOCUMENTS", "MAX_HTML_SIZE", "subdomain_similarity")
+
     # Subdomains of uci.edu to crawl within the styx web cache.
     _allowed_domains = [ "ics.uci.edu", "cs.uci.edu", "informatics.uci.edu", "stat.uci.edu" ]
+    # Every allowed domain is exactly three labels long, so a hostname is allowed
+    # when its last three labels are one of them.
+    _allowed_suffixes = frozenset(_allowed_domains)
 
     # Immutable set of query parameters which indicate dynamic pages.
     # To avoid traps, strip any parameters not in this set from all URLs.
-    _good_params = frozenset( [ "p", "page", "paged", "baldiPage", "page_id", "id", "seminar_id", "attachment_id" "archive_year", "year", "limit", "people", "start", "offset", "limit", "idx", "s", "search", "q", "query", "eventDisplay", "tribe-bar-date", "redirect_to"] )
+    _good_params = frozenset( [ "p", "page", "paged", "baldiPage", "page_id", "id", "seminar_id", "attachment_id", "archive_year", "year", "limit", "people", "start", "offset", "limit", "idx", "s", "search", "q", "query", "eventDisplay", "tribe-bar-date", "redirect_to"] )
 
     # Set of English words to ignore. Pulled from the resource linked in the
     # Canvas assignment documentation: https://www.ranks.nl/stopwords
@@ -19,28 +99,68 @@ class Scraper:
 
 
     def __init__(self):
+        # Guards the shared attributes below. Workers scrape concurrently, so
+        # only the bookkeeping is serialized, never the parsing itself.
+        self.lock = Lock()
+
         # Attributes used for reporting statistics.
-        self.visited_urls = set() # Number of unique pages found. Also used to avoid duplicate pages.
-        self.subdomain_counts = defaultdict(int) # Number of subdomains found, and number of unique pages in them.
-        self.token_counts = defaultdict(int) # The top 50 most common words.
-        self.max_page_url = "" # URL of the longest page.
-        self.max_page_len = 0 # Longest page by measure of word count.
+        # Number of unique pages found. Also used to avoid duplicate pages. A Bloom filter takes
+        # a couple of bytes per URL instead of keeping every URL string, at the cost of
+        # treating about 1 in 10,000 new URLs as already visited.
+        self.visited_urls = ScalableBloomFilter(initial_capacity=1000000, error_rate=0.0001)
+        # The remaining statistics are kept per worker thread, see _get_stats.
+        self._local = local()
+        self._all_stats = []
+
+        # Attribute used for checking if the crawler has been trapped. Only "more than 10"
+        # matters, so approximate counts in a fixed 4 MiB sketch are enough.
+        self.site_counts = CountMinSketch()
 
-        # Attribute used for checking if the crawler has been trapped.
-        self.site_counts = defaultdict(int)
+        # Whether each hostname seen so far is within the allowed domains.
+        self._allowed_hosts = {}
 
         # Attributes used for checking document similarity via tf-idf.
         self.MAX_DOCUMENTS = 20
+
+        # Pages with more raw HTML than this, in bytes, are too large to extract links from.
+        self.MAX_HTML_SIZE = 500000
         # Dictionary that maps unique subdomain URLs to lists of [number of
         # documents, token-frequency mapping, and document fingerprints], where
         # each list contains data specific to the subdomain it is mapped with.
         self.subdomain_similarity = {}
     
 
+    def _get_stats(self):
+        # Statistics of the calling thread, created the first time it scrapes a page.
+        stats = getattr(self._local, "stats", None)
+        if stats is None:
+            stats = self._local.stats = ScraperStats()
+            self._all_stats.append(stats)
+        return stats
+
+
+    # The thread statistics are copied with dict() before merging. The copy is a single
+    # C-level call, so it cannot see a thread's dictionary in the middle of an update.
     def get_top_words(self):
-        # Sort all tokens by descending count and take the first 50.
-        sorted_tokens = sorted(self.token_counts.items(), key=lambda item: item[1], reverse=True)
-        return sorted_tokens[:50]
+        # Merge the token counts of all threads, then take the 50 with the highest count.
+        # most_common uses a bounded heap instead of sorting every token.
+        token_counts = Counter()
+        for stats in list(self._all_stats):
+            token_counts.update(dict(stats.token_counts))
+        return token_counts.most_common(50)
+
+
+    def get_subdomain_counts(self):
+        subdomain_counts = defaultdict(int)
+        for stats in list(self._all_stats):
+            for subdomain, count in dict(stats.subdomain_counts).items():
+                subdomain_counts[subdomain] += count
+        return subdomain_counts
+
+
+    def get_longest_page(self):
+        # Returns the word count and URL of the longest page scraped by any thread.
+        return max((stats.longest_page for stats in list(self._all_stats)), default=(0, ""))
 
 
     def scrape_page(self, url, resp):
@@ -54,108 +174,143 @@ class Scraper:
         #         resp.raw_response.url: the url, again
         # Return a list with the hyperlinks (as strings) scrapped from resp.raw_response.content
 
-        parsed_url = self._get_parsed_url(url, resp)
+        stats = self._get_stats()
+        with self.lock:
+            parsed_url = self._get_parsed_url(url, resp, stats)
         if parsed_url is None:
             # If a new, valid URL cannot be parsed, do not crawl.
             return []
 
         # Parse this page's content.
-        content_type = resp.raw_response.headers.get('Content-Type', '')
-        charset = re.search(r'charset=([^;\s]+)', content_type)
-        encoding = charset.group(1) if charset else 'utf-8'
-        html_content = resp.raw_response.content.decode(encoding, errors='replace')
+        html_content = resp.raw_response.content
 
         # If the HTML content is empty, do not crawl.
         if not html_content:
             return []
 
-        soup = BeautifulSoup(html_content, 'lxml')
-        if not soup or not soup.html:
+        # Size of the html content in bytes. Pages that are too large are rejected
+        # here, before any time is spent parsing them.
+        html_size = len(html_content)
+        if html_size > self.MAX_HTML_SIZE:
+            return []
+
+        # If the server says the page is not HTML (JSON, XML, images, ...), do not parse it.
+        # Pages without a Content-Type are still parsed.
+        content_type = resp.raw_response.headers.get('Content-Type', '')
+        mime_type = content_type.partition(';')[0].strip().lower()
+        if mime_type and mime_type not in _HTML_TYPES:
+            return []
+
+        # Character encoding declared in the header, up to the next ';' or whitespace.
+        encoding = 'utf-8'
+        _, has_charset, charset = content_type.partition('charset=')
+        if has_charset:
+            charset = charset.partition(';')[0].split(None, 1)
+            if charset:
+                encoding = charset[0]
+
+        # lxml decodes the raw bytes itself, using the header's charset as a hint.
+        try:
+            parser = lxml.html.HTMLParser(encoding=encoding)
+        except LookupError:
+            # Unknown charset, let lxml detect the encoding from the page.
+            parser = None
+
+        try:
+            tree = lxml.html.document_fromstring(html_content, parser=parser)
+        except etree.ParserError:
             # If the document is not valid HTML or is from a dead 200 page, do not crawl.
             return []
         
         # Find anchor tags to extract next links from. They are usually menu elements or otherwise low
         # information value, so separate them from informational tokens.
-        anchors = soup.find_all('a', href=True)
-        if not anchors and not soup.find('div'):
+        hrefs = _HREF_XPATH(tree)
+        if not hrefs and tree.find('.//div') is None:
             # If the document does not contain anchor or division tags, it is likely not valid HTML.
             return []
 
-        # Size of the html content in bytes
-        html_size = len(html_content)
-
-        # Get the number of tokens in the html
-        # Tokens are alphanumeric sequences of length 1 or more with no underscores
-        n_tokens = len(re.findall(r'[^\W_]+', soup.get_text().lower()))
-
-        # Remove the anchors from the page to count n_informational_tokens
+        # Get the term frequency of each token in the document for tf-idf, and the number of tokens in the html.
         # Informational tokens are of length 2 or more, not in an <a> tag and are not stopwords
-        for anchor in anchors:
-            anchor.extract()
-
-
-        # Get the term frequency of each token in the document for tf-idf
-        # Don't count stopwords for term_frequency and n_informational_tokens
-        informational_tokens = re.findall(r'[^\W_]{2,}', soup.get_text().lower())
-        n_informational_tokens = 0
-        term_frequencies = defaultdict(int)
-
-        for token in informational_tokens:
-            if token not in self._stopwords:
-                n_informational_tokens += 1
-                term_frequencies[token] += 1
-
-        # Anchor text is not high information most of the time but we count it in term_frequency because layouts share anchors
-        for anchor in anchors:
-            anchor_tokens = re.findall(r'[^\W_]{2,}', anchor.get_text().lower())
-            for token in anchor_tokens:
-                if token not in self._stopwords:
-                    term_frequencies[token] += 1
-
+        term_frequencies = Counter()
+        n_tokens = self._count_tokens(_TEXT_XPATH(tree), term_frequencies)
+        n_informational_tokens = sum(term_frequencies.values())
 
         # If the document has low information value or is simply too large, do not crawl.
+        # This only depends on the informational tokens, so it is decided before the anchor text is counted.
         if not self._has_high_information_value(html_size, n_informational_tokens):
             return []
 
-        if parsed_url.hostname not in self.subdomain_similarity:
-            # Initialize similarity record for new subdomains with 0 documents, an empty token mapping, and no fingerprints.
-            # [0] is n_documents [1] is document_frequency [2] is fingerprints
-            self.subdomain_similarity[parsed_url.hostname] = [0, defaultdict(int), []]
-
-        # Scrape 20 pages/documents from this subdomain to capture a foundation of common words
-        # and page layouts. Only begin fingerprinting after this training period within the 
-        # same subdomain for greater reliability.
-        similarity = self.subdomain_similarity[parsed_url.hostname]
-        if similarity[0] < self.MAX_DOCUMENTS:
-            similarity[0] += 1
-            for token in term_frequencies.keys():
-                similarity[1][token] += 1
-        elif self._is_similar(term_frequencies, n_informational_tokens, similarity[1], similarity[2]):
-            # Do not crawl exact or near duplicate pages after training period.
-            return []
+        # Anchor text is not high information most of the time but we count it in term_frequency because layouts share anchors
+        # A page without links has no anchor text, so the second tree walk is skipped.
+        # Anchor text comes in many short nodes, so they are joined and tokenized in one call.
+        # Joining with a newline keeps words from neighbouring nodes apart.
+        if hrefs:
+            anchor_text = '\n'.join(_ANCHOR_TEXT_XPATH(tree))
+            n_tokens += self._count_tokens((anchor_text,), term_frequencies)
+
+
+        with self.lock:
+            if parsed_url.hostname not in self.subdomain_similarity:
+                # Initialize similarity record for new subdomains with 0 documents, an empty token mapping, and no fingerprints.
+                # [0] is n_documents [1] is document_frequency [2] is fingerprints, packed into a uint64 array
+                # [3] is the idf of each token, filled in once the training period is over, which replaces [1]
+                # [4] is the number of fingerprints stored in [2], the rest of the array is unused space
+                self.subdomain_similarity[parsed_url.hostname] = [0, defaultdict(int), np.empty(64, dtype=np.uint64), None, 0]
+
+            # Scrape 20 pages/documents from this subdomain to capture a foundation of common words
+            # and page layouts. Only begin fingerprinting after this training period within the 
+            # same subdomain for greater reliability.
+            similarity = self.subdomain_similarity[parsed_url.hostname]
+            if similarity[0] < self.MAX_DOCUMENTS:
+                similarity[0] += 1
+                for token in term_frequencies.keys():
+                    similarity[1][token] += 1
+            elif self._is_similar(term_frequencies, n_informational_tokens, similarity):
+                # Do not crawl exact or near duplicate pages after training period.
+                return []
 
         # Update longest page in terms of n_tokens and top 50 token counts statistics.
-        if n_tokens > self.max_page_len:
-            self.max_page_url = resp.url
-            self.max_page_len = n_tokens
-        for token, count in term_frequencies.items():
-            self.token_counts[token] += count
+        if n_tokens > stats.longest_page[0]:
+            stats.longest_page = (n_tokens, resp.url)
+        stats.token_counts.update(term_frequencies)
         
-        return self._extract_next_links(resp.url, anchors)
-
-
-    def _get_parsed_url(self, url, resp):
+        return self._extract_next_links(resp.url, hrefs)
+
+
+    def _count_tokens(self, texts, term_frequencies):
+        # Tokenize the page one text node at a time rather than joining all of its text
+        # into one string. Tokens are alphanumeric sequences of length 1 or more with no
+        # underscores. Adds the ones of length 2 or more that are not stopwords to
+        # term_frequencies, and returns the number of tokens seen.
+        n_tokens = 0
+        for text in texts:
+            if text.isascii():
+                tokens = text.translate(_ASCII_WORD_TABLE).split()
+            else:
+                tokens = _WORD_RE.findall(text.lower())
+            n_tokens += len(tokens)
+            term_frequencies.update(tokens)
+
+        # Every token is counted in C first, then stopwords and single characters are
+        # removed once per distinct token instead of being checked on every occurrence.
+        for token in [token for token in term_frequencies if len(token) < 2 or token in self._stopwords]:
+            del term_frequencies[token]
+        return n_tokens
+
+
+    def _get_parsed_url(self, url, resp, stats):
         # If the HTTP status is 404, the URL will not even be counted as it does not exist.
         if resp.status == 404:
             return None
 
         # The statistic counting the number of unique pages found is based on the URL, not the content.
-        parsed_url = urlparse(url)
+        parsed_url = cached_urlparse(url)
         self.visited_urls.add(url)
-        self.subdomain_counts[parsed_url.hostname] += 1
+        stats.subdomain_counts[parsed_url.hostname] += 1
 
         # Increment times visited count used to check for traps.
-        self.site_counts[parsed_url.netloc + parsed_url.path] += 1
+        site = parsed_url.netloc + parsed_url.path
+        self.site_counts.add(site)
 
         # Case encountered when the crawler is redirected to a different URL.
         if url != resp.url:
@@ -168,7 +323,11 @@ class Scraper:
             if not is_valid(resp.url):
                 # Strip all query parameters not in the _good_params set,
                 # standardizing our URL and avoiding traps.
-                redirect_url = self._remove_query_params(resp.url)
+                try:
+                    redirect_url = _normalize_link(resp.url)
+                except ValueError:
+                    # The URL redirected to is malformed, do not crawl.
+                    return None
 
                 if redirect_url in self.visited_urls or not is_valid(redirect_url):
                     return None
@@ -178,12 +337,13 @@ class Scraper:
                 resp.url = redirect_url
 
             # If the URL redirected to is valid, count it towards statistics too.
-            parsed_url = urlparse(resp.url) # Replace parsed_url.
+            parsed_url = cached_urlparse(resp.url) # Replace parsed_url.
             self.visited_urls.add(resp.url)
-            self.subdomain_counts[parsed_url.hostname] += 1
+            stats.subdomain_counts[parsed_url.hostname] += 1
 
             # Increment times visited count used to check for traps.
-            self.site_counts[parsed_url.netloc + parsed_url.path] += 1
+            site = parsed_url.netloc + parsed_url.path
+            self.site_counts.add(site)
 
         # If the HTTP status is not 200 OK, do not crawl.
         if resp.status != 200:
@@ -191,7 +351,7 @@ class Scraper:
 
         # If this page has been visited too many times with different query parameters,
         # it is a trap, so do not crawl.
-        if self._is_trap(parsed_url):
+        if self._is_trap(site):
             return None
         
         return parsed_url
@@ -201,6 +361,7 @@ class Scraper:
         # URLs will still be counted as visited regardless, but:
         #   - If a page's raw HTML is greater than 500 KB, regardless of token
         #     count, it is too large to be worth extracting new links from.
+        #     scrape_page rejects these before parsing, so they never get here.
         #
         #   OR
         # 
@@ -212,87 +373,103 @@ class Scraper:
         #   - If a page's raw HTML is greater than 300 KB AND its content contains
         #     less than 100 informational tokens, it is fairly large while also likely
         #     having low information value, so it is not worth extracting new links from.
-        MAX_HTML_SIZE = 500000
+        MAX_HTML_SIZE = self.MAX_HTML_SIZE
         MIN_TOKENS = 50
 
-        html_too_large = html_size > MAX_HTML_SIZE
-        not_enough_tokens = num_info_tokens < MIN_TOKENS
-        not_enough_tokens_for_large_html = (html_size > MAX_HTML_SIZE - 200000) and (num_info_tokens < MIN_TOKENS * 2)
-
-        if html_too_large or not_enough_tokens or not_enough_tokens_for_large_html:
+        # Return as soon as one check fails.
+        if num_info_tokens < MIN_TOKENS:
+            return False
+        if html_size > MAX_HTML_SIZE - 200000 and num_info_tokens < MIN_TOKENS * 2:
             return False
         return True
 
 
-    def _is_similar(self, term_frequencies, n_terms, document_frequencies, fingerprints):
+    def _is_similar(self, term_frequencies, n_terms, similarity_record):
         # SimHash algorithm, fixing binary hash width to 64 bits. Weight words using
         # term frequency -- inverse document frequency (tf-idf).
         WIDTH = 64
         THRESHOLD = 0.80
+        # Pages are similar when at least THRESHOLD of their bits match, that is when
+        # at most this many bits differ (12 of 64).
+        MAX_DIFFERENT_BITS = WIDTH - math.ceil(THRESHOLD * WIDTH)
+
+        # Document frequencies stop changing after the training period, so the idf of
+        # every token seen during it is computed once, on the first call for the subdomain.
+        idf_lookup = similarity_record[3]
+        if idf_lookup is None:
+            document_frequencies = similarity_record[1]
+            doc_frequencies = np.fromiter(document_frequencies.values(), dtype=np.float64, count=len(document_frequencies))
+            idf = np.log10(self.MAX_DOCUMENTS / (1 + doc_frequencies))
 
-        # Build 64-dimensional vector V to hold weighted components.
-        vec_v = np.zeros(WIDTH, dtype=np.float64)
+            # If the token appeared in 19 or 20 documents, set a minimum above 0
+            # so the weight is still captured, just minimally.
+            idf[idf <= 0] = 0.001
+            idf_lookup = similarity_record[3] = dict(zip(document_frequencies.keys(), idf.tolist()))
+            # The raw counts are never read again, only the idf table.
+            similarity_record[1] = None
 
-        for token, frequency in term_frequencies.items():
-            if frequency == 0: # Exclude uncounted tokens.
-                continue
+        # Tokens that did not appear in any training document get the highest idf.
+        unseen_idf = math.log10(self.MAX_DOCUMENTS)
 
-            tf = frequency / n_terms
-            idf = np.log10(self.MAX_DOCUMENTS / (1 + document_frequencies[token]))
+        # Every counted token, with its term frequency and idf as arrays. Exclude uncounted tokens.
+        tokens = [token for token, frequency in term_frequencies.items() if frequency != 0]
+        frequencies = np.fromiter((term_frequencies[token] for token in tokens), dtype=np.float64, count=len(tokens))
+        idf = np.fromiter((idf_lookup.get(token, unseen_idf) for token in tokens), dtype=np.float64, count=len(tokens))
 
-            # If the token appeared in 19 or 20 documents, set a minimum above 0
-            # so the weight is still captured, just minimally.
-            if idf <= 0:
-                idf = 0.001
-
-            # Token weight.
-            tf_idf = tf * idf
-
-            # Convert the hash of the current token to a binary string.
-            hashed_token = hash(token)
-            hashed_str = '{:b}'.format(hashed_token)
-
-            # Oftentimes the width of the binary-formatted string of the token's hash
-            # will be slightly less than 64 bits, so manually sign extend it.
-            extend_bit = '0'
-            if hashed_token < 0:
-                hashed_str = hashed_str[1:]
-                extend_bit = '1'
-            
-            for _ in range(64 - len(hashed_str)):
-                hashed_str = extend_bit + hashed_str
-
-            bits = np.array([1.0 if bit == '1' else -1.0 for bit in hashed_str], dtype=np.float64)
-            vec_v += bits * tf_idf
-
-        # Reduce V back to binary vased on whether V[i] is positive or negative.
-        # V is now the fingerprint of this webpage.
-        vec_v = np.where(vec_v >= 0, 1, 0)
-
-        for fingerprint in fingerprints:
-            # Check for similarity by comparing the number of bits that are the same between the fingerprints.
-            same_bits = np.sum(vec_v == fingerprint)
-            similarity = same_bits / WIDTH
-            if similarity >= THRESHOLD: 
-                return True
+        tf = frequencies / n_terms
+
+        # Token weights.
+        weights = tf * idf
+
+        # Unlike hash(), blake2b is the same in every process and mixes all 64 bits well.
+        digests = b''.join(blake2b(token.encode('utf-8'), digest_size=8).digest() for token in tokens)
+
+        # Expand every digest into a row of its 64 bits.
+        bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(-1, 8), axis=1)
+
+        # Build 64-dimensional vector V by adding up the weighted +1/-1 components of all tokens.
+        # Summing weight * (2 * bit - 1) equals 2 * (weights @ bits) - sum(weights), which skips
+        # building the matrix of +1/-1 components.
+        vec_v = 2 * (weights @ bits) - weights.sum()
+
+        # Reduce V back to binary vased on whether V[i] is positive or negative, packed
+        # into a single 64 bit integer. This is now the fingerprint of this webpage.
+        fingerprint = np.packbits(vec_v >= 0).view('>u8').astype(np.uint64)
+
+        # Check for similarity against every stored fingerprint at once by comparing
+        # the number of bits that are the same between the fingerprints.
+        fingerprints, n_fingerprints = similarity_record[2], similarity_record[4]
+        different_bits = _popcount64(fingerprints[:n_fingerprints] ^ fingerprint)
+        if np.any(different_bits <= MAX_DIFFERENT_BITS):
+            return True
 
         # If the webpage is unique (not sufficiently similar to other webpages),
-        # update the list of fingerprints for visited webpages.
-        fingerprints.append(vec_v)
+        # update the array of fingerprints for visited webpages. The array is
+        # doubled when full so that adding a fingerprint rarely copies it.
+        if n_fingerprints == len(fingerprints):
+            fingerprints = similarity_record[2] = np.resize(fingerprints, 2 * len(fingerprints))
+        fingerprints[n_fingerprints] = fingerprint[0]
+        similarity_record[4] = n_fingerprints + 1
 
         return False
 
 
-    def _extract_next_links(self, base_url, anchors):
+    def _extract_next_links(self, base_url, hrefs):
         # Extract all linked URLs from the webpage.
+        # Split the base URL once for the whole page rather than once per link.
+        base = urlsplit(base_url)
         links = set()
-        for link in anchors:
-            href = link.get('href')
-            if href is not None:
-                # Join relative links to the base URL.
-                joined_url = urljoin(base_url, href, allow_fragments=False)
-                # Strip all query parameters not in the set of known good parameters.
-                link = self._remove_query_params(joined_url)
+        for href in hrefs:
+            if not href.lstrip()[:11].lower().startswith(_SKIP_HREF_PREFIXES):
+                try:
+                    # Join relative links to the base URL.
+                    joined_url = self._join_url(base, href)
+                    # Strip all query parameters not in the set of known good parameters,
+                    # then canonicalize so different spellings of a page collapse into one.
+                    link = _normalize_link(joined_url)
+                except ValueError:
+                    # Malformed link that cannot be split, such as an invalid IPv6 host. Skip it.
+                    continue
 
                 if link not in self.visited_urls and is_valid(link):
                     links.add(link)
@@ -300,17 +477,51 @@ class Scraper:
         return list(links)
 
 
+    def _join_url(self, base, href):
+        # Same result as urljoin() with the fragment dropped for every link with a
+        # host, but only the relative href is parsed. base is the page's already split URL.
+        # Absolute http(s) links and root-relative paths without dot segments are
+        # the most common forms, and need no parsing at all.
+        if href.startswith(('http://', 'https://')):
+            # Not when the host is empty, as in 'https:///x' or 'https://?q', which urljoin
+            # resolves against the page.
+            host_start = 8 if href[4] == 's' else 7
+            if href[host_start:host_start + 1] not in '/?#':
+                return href.partition('#')[0]
+        if href.startswith('/') and not href.startswith('//') and '/.' not in href:
+            return base.scheme + '://' + base.netloc + href.partition('#')[0]
+
+        rel = urlsplit(href)
+        if rel.netloc:
+            # Absolute or scheme-relative link, only the scheme can be inherited.
+            return urlunsplit((rel.scheme or base.scheme, rel.netloc, rel.path, rel.query, ''))
+        if rel.scheme and rel.scheme != base.scheme:
+            # Another scheme and no host, nothing is inherited from the page.
+            return href.partition('#')[0]
+        # A link with the page's own scheme but no host, such as 'https:foo', is
+        # resolved like any relative link below, as urljoin does.
+        if not rel.path:
+            # Empty or query-only link, stays on the base page.
+            return urlunsplit((base.scheme, base.netloc, base.path, rel.query or base.query, ''))
+        if rel.path.startswith('//') or ':' in rel.path.partition('/')[0]:
+            # On its own this path would be read as a host or a scheme, so join the whole URL instead.
+            return urljoin(urlunsplit(base), href).partition('#')[0]
+        # Resolve the relative path, including any '.' and '..' segments, against the base path.
+        path = urljoin(base.path or '/', rel.path)
+        return urlunsplit((base.scheme, base.netloc, path, rel.query, ''))
+
+
     def _is_valid_domain(self, parsed_url):
         # Return True if the URL's domain is within the set of allowed domains/subdomains.
         domain = parsed_url.hostname
         path = parsed_url.path
 
-        if not domain:
-            return False
-
-        for ad in self._allowed_domains:
-            if domain == ad or domain.endswith("." + ad):
-                return True
+        # A crawl only ever sees a limited number of hostnames, so each one is checked once.
+        allowed = self._allowed_hosts.get(domain)
+        if allowed is None:
+            allowed = self._allowed_hosts[domain] = self._is_allowed_host(domain)
+        if allowed:
+            return True
 
         # Special case for "today.uci.edu/department/information_computer_sciences/*".
         if domain == "today.uci.edu" and path.startswith("/department/information_computer_sciences/"):
@@ -319,28 +530,45 @@ class Scraper:
         return False
 
 
-    def _is_trap(self, parsed_url):
-        # If the same page with different query parameters has been visited more than 10 times, it is likely a trap.
-        site = parsed_url.netloc + parsed_url.path
+    def _is_allowed_host(self, domain):
+        if not domain or not domain.endswith(".uci.edu"):
+            return False
+        suffix = '.'.join(domain.rsplit('.', 3)[-3:])
+        return suffix in self._allowed_suffixes
+
+
+    def _is_trap(self, site):
+        # If the same page (netloc + path) with different query parameters has been visited more than 10 times, it is likely a trap.
         return self.site_counts[site] > 10
 
 
     def _remove_query_params(self, url):
         # Remove any query parameters that are known to cause traps.
         # Also remove any fragments.
-        parsed_url = urlparse(url)
-        queries = parse_qs(parsed_url.query)
-
-        params_to_remove = []
-        for param in queries.keys():
-            if param.split('[')[0] not in self._good_params:
-                params_to_remove.append(param)
-        for param in params_to_remove: # Modify dictionary after identifying bad parameters.
-            del queries[param]
-
-        query_string = urlencode(queries, doseq=True)
+        if '?' not in url and '#' not in url:
+            # Most links have neither, so there is nothing to remove.
+            return url
+        # urlsplit does not split off ;params, which are kept as part of the path anyway.
+        parsed_url = urlsplit(url)
+
+        # Only the keys decide what is kept, so the query is split on '&' and '='
+        # instead of decoding every value with parse_qs. Parameters with no value
+        # are dropped, as parse_qs does.
+        params = parsed_url.query.split('&')
+        kept_params = []
+        for param in params:
+            key, _, value = param.partition('=')
+            if not value:
+                continue
+            if '%' in key or '+' in key:
+                key = unquote_plus(key)
+            if key.split('[')[0] in self._good_params:
+                kept_params.append(param)
 
-        return urlunparse((parsed_url.scheme, parsed_url.netloc, parsed_url.path, parsed_url.params, query_string, ''))
+        if len(kept_params) == len(params) and not parsed_url.fragment:
+            # Every parameter was kept and there is no fragment, so the URL is unchanged.
+            return url
+        return urlunsplit(parsed_url._replace(query='&'.join(kept_params), fragment=''))
 
 # End class Scraper
 
@@ -352,37 +580,48 @@ def scraper(url, resp):
     return s.scrape_page(url, resp)
 
 
+@lru_cache(maxsize=65536)
+def _normalize_link(url):
+    # Deparameterized, canonical form of a link. Only depends on the URL, since
+    # _good_params never changes, so the links repeated on every page of a site
+    # are only split and rebuilt once.
+    return canonicalize(s._remove_query_params(url))
+
+
+@lru_cache(maxsize=131072)
+def _get_crawlable_site(url):
+    # The checks of is_valid that only depend on the URL itself. Cached, because the same
+    # navigation links show up on nearly every page of a site. Returns the netloc + path
+    # used to check for traps, or None if the URL is never worth crawling.
+    parsed_url = cached_urlparse(url)
+    if parsed_url.scheme not in _SCHEMES:
+        return None
+
+    # Filter out files that are not HTML/webpages. Only the extension after
+    # the last '.' is lowercased, not the whole path.
+    path = parsed_url.path
+    dot = path.rfind('.')
+    if dot != -1 and path[dot + 1:].lower() in _BAD_EXT:
+        return None
+
+    if not s._is_valid_domain(parsed_url):
+        return None
+
+    return parsed_url.netloc + path
+
+
 def is_valid(url):
     # Decide whether to crawl this url or not. 
     # If you decide to crawl it, return True; otherwise return False.
     # There are already some conditions that return False.
     try:
-        parsed_url = urlparse(url)
-        if parsed_url.scheme not in set(["http", "https"]):
-            return False
-
-        # Filter out files that are not HTML/webpages.
-        if re.match(
-            r".*\.(css|js|bmp|gif|jpe?g|ico"
-                + r"|png|tiff?|mid|mp2|mp3|mp4"
-                + r"|wav|avi|mov|mpeg|ram|m4v|mkv|ogg|ogv|pdf"
-                + r"|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names"
-                + r"|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso"
-                + r"|epub|dll|cnf|tgz|sha1"
-                + r"|thmx|mso|arff|rtf|jar|csv"
-                + r"|rm|smil|wmv|swf|wma|zip|rar|gz"
-                + r"|ppsx|pps|txt|bib|sql|xml|pov|tsv|mat|in|out|scm|db"
-                + r"|1_manual|2_manual|mpg|img|svg|webp|heic|lif|hqx|fig"
-                + r"|lsp|java|war|c|h|cpp|hpp|cp|sh|ss|pl|rss|ff"
-                + r"|rle|Z|shar|ova|edelsbrunner|class|prn"
-                + r"|conf|cls|can|odp|results|sas|odc|ma|pd|mol|grm|nb)$", parsed_url.path.lower()):
-            return False
-
-        if not s._is_valid_domain(parsed_url) or s._is_trap(parsed_url):
-            return False
-
-        return True
+        site = _get_crawlable_site(url)
+        # Trap counts change as the crawl goes on, so they are checked on every call.
+        return site is not None and not s._is_trap(site)
     except TypeError:
         print ("TypeError for url")
         return False
+    except ValueError:
+        # Malformed URL that cannot be split, such as an invalid IPv6 host.
+        return False
 
@@ -1,7 +1,9 @@
 import os
+import re
+import string
 import logging
 from hashlib import sha256
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urlsplit, urlunsplit, parse_qsl, urlencode
 
 def get_logger(name, filename=None):
     logger = logging.getLogger(name)
@@ -33,3 +35,38 @@ def normalize(url):
     if url.endswith("/"):
         return url.rstrip("/")
     return url
+
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+_UNRESERVED = frozenset(string.ascii_letters + string.digits + "-._~")
+_ESCAPE_RE = re.compile(r"%([0-9a-fA-F]{2})")
+_SLASHES_RE = re.compile(r"/{2,}")
+
+def _normalize_escape(match):
+    # Decode escaped characters that never needed escaping, and uppercase the rest.
+    char = chr(int(match.group(1), 16))
+    return char if char in _UNRESERVED else match.group(0).upper()
+
+def canonicalize(url):
+    # Rewrite url so that every spelling of the same page hashes the same:
+    # lowercase scheme and host, no default port, no fragment, no repeated
+    # slashes, normalized escapes, sorted query parameters.
+    parsed = urlsplit(url)
+    scheme = parsed.scheme.lower()
+    try:
+        port = parsed.port
+    except ValueError:
+        # Invalid port, leave the url as it is.
+        return normalize(url)
+
+    netloc = parsed.hostname or ""
+    if ":" in netloc:
+        netloc = f"[{netloc}]" # IPv6 literal.
+    if port is not None and port != _DEFAULT_PORTS.get(scheme):
+        netloc = f"{netloc}:{port}"
+    if "@" in parsed.netloc:
+        netloc = f"{parsed.netloc.rpartition('@')[0]}@{netloc}"
+
+    path = _ESCAPE_RE.sub(_normalize_escape, _SLASHES_RE.sub("/", parsed.path))
+    query = urlencode(sorted(parse_qsl(parsed.query, keep_blank_values=True)))
+    return normalize(urlunsplit((scheme, netloc, path, query, "")))
@@ -0,0 +1,78 @@
+import math
+from hashlib import blake2b
+
+
+def _hash_key(key):
+    # Double hashing: every bit index is derived from the two halves of one digest.
+    digest = blake2b(key.encode("utf-8"), digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+
+class BloomFilter(object):
+    ''' Fixed size set membership with no false negatives and roughly
+        error_rate false positives once capacity keys have been added. '''
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _get_indexes(self, hashes):
+        h1, h2 = hashes
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def _contains_hashes(self, hashes):
+        for index in self._get_indexes(hashes):
+            if not self.bits[index >> 3] & (1 << (index & 7)):
+                return False
+        return True
+
+    def _add_hashes(self, hashes):
+        added = False
+        for index in self._get_indexes(hashes):
+            mask = 1 << (index & 7)
+            if not self.bits[index >> 3] & mask:
+                self.bits[index >> 3] |= mask
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+    def __contains__(self, key):
+        return self._contains_hashes(_hash_key(key))
+
+    def add(self, key):
+        ''' Adds key to the filter. Returns True if it was not already in it. '''
+        return self._add_hashes(_hash_key(key))
+
+    def __len__(self):
+        return self.count
+
+
+class ScalableBloomFilter(object):
+    ''' Bloom filter that grows as keys are added. Each new filter doubles the
+        capacity and halves the error rate of the last, so the overall false
+        positive rate stays under error_rate no matter how many keys are added. '''
+    def __init__(self, initial_capacity=1000000, error_rate=0.001):
+        self.filters = [BloomFilter(initial_capacity, error_rate / 2)]
+
+    def __contains__(self, key):
+        hashes = _hash_key(key)
+        return any(bloom._contains_hashes(hashes) for bloom in self.filters)
+
+    def add(self, key):
+        ''' Adds key to the filter. Returns True if it was not already in it. '''
+        hashes = _hash_key(key)
+        if any(bloom._contains_hashes(hashes) for bloom in self.filters):
+            return False
+
+        bloom = self.filters[-1]
+        if bloom.count >= bloom.capacity:
+            bloom = BloomFilter(bloom.capacity * 2, bloom.error_rate / 2)
+            self.filters.append(bloom)
+        return bloom._add_hashes(hashes)
+
+    def __len__(self):
+        return sum(len(bloom) for bloom in self.filters)
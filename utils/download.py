@@ -1,12 +1,22 @@
 import requests
 import cbor
 import time
+import threading
 
 from utils.response import Response
 
+# One keep-alive session per worker thread, so consecutive downloads reuse
+# the connection to the cache server instead of reconnecting every time.
+_local = threading.local()
+
+def _get_session():
+    if not hasattr(_local, "session"):
+        _local.session = requests.Session()
+    return _local.session
+
 def download(url, config, logger=None):
     host, port = config.cache_server
-    resp = requests.get(
+    resp = _get_session().get(
         f"http://{host}:{port}/",
         params=[("q", f"{url}"), ("u", f"{config.user_agent}")])
     try:
@@ -0,0 +1,27 @@
+import numpy as np
+from hashlib import blake2b
+
+
+class CountMinSketch(object):
+    ''' Approximate counts of keys in a fixed amount of memory. A count is never
+        underestimated, and counters saturate at 255 instead of wrapping. '''
+    def __init__(self, depth=4, width_bits=20):
+        # Every row takes width_bits from one 128 bit digest of the key.
+        assert depth * width_bits <= 128
+        self.depth = depth
+        self.width_bits = width_bits
+        self.mask = (1 << width_bits) - 1
+        self.table = np.zeros((depth, 1 << width_bits), dtype=np.uint8)
+        self._rows = np.arange(depth)
+
+    def _get_indexes(self, key):
+        digest = int.from_bytes(blake2b(key.encode("utf-8"), digest_size=16).digest(), "little")
+        return [(digest >> (i * self.width_bits)) & self.mask for i in range(self.depth)]
+
+    def add(self, key):
+        indexes = self._get_indexes(key)
+        counts = self.table[self._rows, indexes]
+        self.table[self._rows, indexes] = np.minimum(counts, 254) + 1
+
+    def __getitem__(self, key):
+        return int(self.table[self._rows, self._get_indexes(key)].min())
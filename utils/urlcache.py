@@ -0,0 +1,10 @@
+from functools import lru_cache
+from urllib.parse import urlparse
+
+
+# The same url is parsed by the scraper, the validity checks and the
+# frontier's politeness bookkeeping. ParseResult is an immutable tuple, so
+# one parse can safely be shared between all of them.
+@lru_cache(maxsize=4096)
+def cached_urlparse(url):
+    return urlparse(url)